@@ -4,7 +4,10 @@ import numpy as np
 import requests
 from io import BytesIO
 import os
+import re
 import datetime
+from openpyxl.utils import get_column_letter
+from margin_simulation import MAX_FX_SD, sample_scenarios, simulate_margins
 
 # -----------------------
 # Config / Defaults
@@ -12,6 +15,8 @@ import datetime
 DEFAULT_EXCEL_PATH = "print_costs.xlsx"  # default path
 DEFAULT_SHEET = "costs"
 OFFERED_SIZES = ["15x21" , "21x30", "30x40", "35x45" , "45x60", "60x80"]
+MONKEY_FALLBACK_POSTAGE_GBP = 6.5
+ARTELO_FALLBACK_POSTAGE_EUR = 15
 
 st.set_page_config(page_title="CoffeeAvocado — Print Pricing", layout="wide")
 
@@ -34,49 +39,174 @@ def fetch_gbp_to_eur_rate():
         pass
     return 1.17
 
+class WorkbookSchemaError(ValueError):
+    """Raised when the Excel file does not match the expected cost matrix layout."""
+
+# Row labels recognised in the first filled cell of a row (normalised, see _normalise_label)
+ROW_LABELS = {
+    "sizes": ("size", "sizes", "size cm2"),
+    "monkey_price_gbp": ("monkey price", "monkey puzzle price", "monkey price gbp"),
+    "monkey_postage_gbp": ("monkey postage", "monkey puzzle postage", "monkey postage gbp"),
+    "artelo_price_eur": ("artelo price", "artelo price eur"),
+    "artelo_postage_eur": ("artelo postage", "artelo postage eur"),
+    "etsy_price_eur": ("etsy", "etsy price", "etsy price eur"),
+}
+LABEL_ROLES = {label: role for role, labels in ROW_LABELS.items() for label in labels}
+COST_ROWS = ["monkey_price_gbp", "monkey_postage_gbp", "artelo_price_eur", "artelo_postage_eur"]
+POSTAGE_ROWS = ["monkey_postage_gbp", "artelo_postage_eur"]
+# Unlabelled rows sit at fixed offsets below the "MP PRICES" cell (row 5 in print_costs.xlsx)...
+ANCHOR_LABEL = "mp prices"
+ANCHOR_OFFSETS = {"monkey_price_gbp": 1, "monkey_postage_gbp": 2, "artelo_price_eur": 4, "artelo_postage_eur": 5, "etsy_price_eur": 7}
+# ...or, without that cell, below the sizes row
+SIZES_OFFSETS = {"monkey_price_gbp": 5, "monkey_postage_gbp": 6, "artelo_price_eur": 8, "artelo_postage_eur": 9, "etsy_price_eur": 11}
+# A blank positional row with unclaimed data this many rows away means the layout has drifted
+DRIFT_WINDOW = 2
+
+def _normalise_label(val):
+    return re.sub(r"[\s_:]+", " ", str(val)).strip().lower()
+
+def _cell_ref(row_idx, col_idx):
+    return f"{get_column_letter(col_idx + 1)}{row_idx + 1}"
+
+def _numeric_rows(df):
+    """Coerces the sheet to numbers row by row (few rows, but stray cells can reach column XFD)."""
+    rows = [pd.to_numeric(row, errors="coerce") for row in df.to_numpy(dtype=object)]
+    return pd.DataFrame(np.array(rows, dtype=float).reshape(df.shape), index=df.index, columns=df.columns)
+
+def _sheet_row(frame, row_idx):
+    """Row of the sheet, or an empty row when the layout points past the last filled row."""
+    return frame.iloc[row_idx] if row_idx < frame.shape[0] else pd.Series(np.nan, index=frame.columns, dtype=object)
+
+def _is_label(cell):
+    return isinstance(cell, str) and _normalise_label(cell) in LABEL_ROLES
+
+def resolve_layout(df, numeric):
+    """Finds the row index of each cost matrix row (sizes, supplier prices/postage, Etsy price)."""
+    labelled, anchors = {}, []
+    for idx in range(df.shape[0]):
+        first_col = df.iloc[idx].first_valid_index()
+        cell = df.iloc[idx][first_col] if first_col is not None else None
+        if not isinstance(cell, str):
+            continue
+        label = _normalise_label(cell)
+        if label == ANCHOR_LABEL:
+            anchors.append(idx)
+        elif label in LABEL_ROLES:
+            labelled.setdefault(LABEL_ROLES[label], []).append(idx)
+
+    ambiguous = {role: rows for role, rows in labelled.items() if len(rows) > 1}
+    if len(anchors) > 1:
+        ambiguous["MP PRICES"] = anchors
+    if ambiguous:
+        details = "; ".join(f"{role} (rows {', '.join(str(idx + 1) for idx in rows)})" for role, rows in ambiguous.items())
+        raise WorkbookSchemaError(f"More than one row matches: {details}.")
+
+    # Explicitly labelled rows take precedence over the positional layout
+    layout = {role: rows[0] for role, rows in labelled.items()}
+
+    if "sizes" not in layout:
+        # Sizes are a strictly increasing numeric row; with an anchor it must be the only one above it
+        increasing = []
+        for idx in range(anchors[0] if anchors else df.shape[0]):
+            row_nums = numeric.iloc[idx].dropna()
+            if len(row_nums) >= 2 and row_nums.is_monotonic_increasing and row_nums.is_unique:
+                increasing.append(idx)
+                if not anchors:
+                    break
+        if not increasing:
+            raise WorkbookSchemaError("Could not find the sizes row (a row of increasing cm² values).")
+        if len(increasing) > 1:
+            raise WorkbookSchemaError(f"More than one row matches: sizes (rows {', '.join(str(idx + 1) for idx in increasing)}).")
+        layout["sizes"] = increasing[0]
+
+    # Fixed offsets keep blank rows in their slot instead of shifting later rows up
+    origin, offsets = (anchors[0], ANCHOR_OFFSETS) if anchors else (layout["sizes"], SIZES_OFFSETS)
+    for role, offset in offsets.items():
+        layout.setdefault(role, origin + offset)
+
+    rows_used = pd.Series(layout)
+    clashes = rows_used[rows_used.duplicated(keep=False)]
+    if not clashes.empty:
+        raise WorkbookSchemaError(f"Rows overlap in the layout: {', '.join(f'{role}=row {idx + 1}' for role, idx in clashes.items())}.")
+
+    # Positional rows must not be blank while an unclaimed row right next to them holds data
+    size_cols = numeric.iloc[layout["sizes"]].notna()
+    filled = numeric.loc[:, size_cols].notna().any(axis=1)
+    claimed = set(layout.values()) | set(anchors)
+    for role in offsets:
+        row_idx = layout[role]
+        if role in labelled or (row_idx < df.shape[0] and filled[row_idx]):
+            continue
+        nearby = [
+            idx for idx in range(row_idx - DRIFT_WINDOW, row_idx + DRIFT_WINDOW + 1)
+            if 0 <= idx < df.shape[0] and idx not in claimed and filled[idx]
+        ]
+        if nearby:
+            raise WorkbookSchemaError(
+                f"Row {row_idx + 1} ({role}) is empty but row {nearby[0] + 1} next to it has values; "
+                f"the layout may have shifted. Label the row (e.g. '{ROW_LABELS[role][0].capitalize()}') in its first cell."
+            )
+
+    return {role: int(idx) for role, idx in layout.items()}
+
+def validate_layout(df, numeric, layout):
+    """Checks the resolved rows hold the expected types; raises WorkbookSchemaError otherwise."""
+    sizes = numeric.iloc[layout["sizes"]]
+    size_cols = sizes.notna()
+    if not size_cols.any():
+        raise WorkbookSchemaError(f"Row {layout['sizes'] + 1} has no numeric sizes.")
+    if (sizes[size_cols] <= 0).any() or not sizes[size_cols].round().is_unique:
+        raise WorkbookSchemaError(f"Sizes in row {layout['sizes'] + 1} must be positive and unique.")
+
+    for role, row_idx in layout.items():
+        if role == "sizes":
+            continue
+        cells = _sheet_row(df, row_idx)[size_cols]
+        values = _sheet_row(numeric, row_idx)[size_cols]
+        # The label of a labelled row may sit in a size column; it is not data
+        is_data = cells.notna() & ~cells.map(_is_label)
+        bad = cells.index[is_data & values.isna()].tolist() + cells.index[values < 0].tolist()
+        if bad:
+            refs = ", ".join(_cell_ref(row_idx, col) for col in bad[:5])
+            raise WorkbookSchemaError(f"Row {row_idx + 1} ({role}) has non-numeric or negative values at {refs}.")
+        # Blank postage rows fall back to the default postage; blank price rows mean a broken layout
+        if role in ("monkey_price_gbp", "artelo_price_eur") and values.isna().all():
+            raise WorkbookSchemaError(f"Row {row_idx + 1} ({role}) has no prices.")
+
+@st.cache_data(max_entries=8)
+def _parse_matrix_excel(data, sheet):
+    """Parses workbook bytes into the tidy cost frame; cached so reruns skip the slow openpyxl read."""
+    df = pd.read_excel(BytesIO(data), sheet_name=sheet, header=None, engine="openpyxl")
+
+    # A single object block keeps row access cheap on a sheet that is mostly empty columns
+    df = pd.DataFrame(df.to_numpy(dtype=object), index=df.index, columns=df.columns)
+    numeric = _numeric_rows(df)
+    layout = resolve_layout(df, numeric)
+    validate_layout(df, numeric, layout)
+
+    sizes = numeric.iloc[layout["sizes"]]
+    size_cols = sizes.notna()
+    tidy = pd.DataFrame({"size_cm2": sizes[size_cols].round().astype(int)})
+    for column in COST_ROWS + ["etsy_price_eur"]:
+        tidy[column] = _sheet_row(numeric, layout[column])[size_cols].astype(float)
+    return tidy.sort_values("size_cm2").reset_index(drop=True)
+
 def read_matrix_excel(path, sheet=DEFAULT_SHEET):
     """Reads the cost matrix from the Excel file and converts it to a tidy DataFrame."""
+    if hasattr(path, "getvalue"):
+        data = path.getvalue()
+    elif hasattr(path, "read"):
+        data = path.read()
+    else:
+        with open(path, "rb") as f:
+            data = f.read()
+
     try:
-        df = pd.read_excel(path, sheet_name=sheet, header=None, engine="openpyxl")
+        return _parse_matrix_excel(data, sheet)
     except KeyError:
         # Handle case where the sheet name is wrong
         st.error(f"Sheet '{sheet}' not found in the Excel file.")
         return pd.DataFrame()
-        
-    max_col = df.shape[1]
-    # Row 0 contains the sizes (Column headers in original matrix)
-    sizes = df.iloc[0, :].tolist()
-    
-    # Extract data from specific rows based on the original layout
-    monkey_prices = df.iloc[5, :].tolist() if df.shape[0] > 5 else [None] * max_col
-    monkey_postage = df.iloc[6, :].tolist() if df.shape[0] > 6 else [None] * max_col
-    artelo_prices = df.iloc[8, :].tolist() if df.shape[0] > 8 else [None] * max_col
-    artelo_postage = df.iloc[9, :].tolist() if df.shape[0] > 9 else [None] * max_col
-
-    tidy = []
-    for i, s in enumerate(sizes):
-        # Skip empty or non-numeric size columns
-        if pd.isna(s):
-            continue
-        try:
-            size_val = float(s)
-            size_int = int(round(size_val))
-        except:
-            continue
-            
-        # Helper function to convert value to float or None
-        def safe_float(val, fallback=None):
-            return fallback if pd.isna(val) else float(val)
-
-        row = {
-            "size_cm2": size_int,
-            "monkey_price_gbp": safe_float(monkey_prices[i]),
-            "monkey_postage_gbp": safe_float(monkey_postage[i]),
-            "artelo_price_eur": safe_float(artelo_prices[i]),
-            "artelo_postage_eur": safe_float(artelo_postage[i]),
-        }
-        tidy.append(row)
-    return pd.DataFrame(tidy).sort_values("size_cm2").reset_index(drop=True)
 
 def compute_cost_for_choice(row, printer, gbp_to_eur_rate):
     """Calculates the base cost (Print + Postage) in EUR."""
@@ -86,12 +216,12 @@ def compute_cost_for_choice(row, printer, gbp_to_eur_rate):
     postage_eur = row["artelo_postage_eur"]
     
     if printer == "Monkey Puzzle":
-        if price_gbp is None:
+        if pd.isna(price_gbp):
              return None, None, None, None, None # total, postage_eur, original_price_local, original_postage_local, print_cost_eur
         
         # Use a fallback postage if not specified
-        if postage_gbp is None:
-            postage_gbp = 6.5
+        if pd.isna(postage_gbp):
+            postage_gbp = MONKEY_FALLBACK_POSTAGE_GBP
             
         total_gbp = price_gbp + postage_gbp
         total_eur = total_gbp * gbp_to_eur_rate
@@ -101,12 +231,12 @@ def compute_cost_for_choice(row, printer, gbp_to_eur_rate):
         return round(total_eur, 2), round(postage_eur, 2), price_gbp, postage_gbp, round(print_cost_eur, 2)
         
     elif printer == "Artelo":
-        if price_eur is None:
+        if pd.isna(price_eur):
             return None, None, None, None, None # total, postage_eur, original_price_local, original_postage_local, print_cost_eur
 
         # Use a fallback postage if not specified
-        if postage_eur is None:
-            postage_eur = 15
+        if pd.isna(postage_eur):
+            postage_eur = ARTELO_FALLBACK_POSTAGE_EUR
             
         total_eur = price_eur + postage_eur
         # Prices are already in EUR
@@ -144,6 +274,148 @@ def calc_final_price(base_cost_eur, profit_percent, min_profit_eur, etsy_fee_per
     
     return round(final_price, 2), round(profit_eur, 2), round(tax_eur, 2)
 
+def compute_costs_table(costs_df, gbp_to_eur_rate):
+    """Vectorized compute_cost_for_choice: base cost (Print + Postage) in EUR for every size x printer."""
+    monkey_postage_gbp = costs_df["monkey_postage_gbp"].astype(float).fillna(MONKEY_FALLBACK_POSTAGE_GBP)
+    artelo_postage_eur = costs_df["artelo_postage_eur"].astype(float).fillna(ARTELO_FALLBACK_POSTAGE_EUR)
+
+    # Missing print prices stay NaN so the size is reported as "no cost data" for that printer
+    monkey = pd.DataFrame({
+        "size_cm2": costs_df["size_cm2"],
+        "printer": "Monkey Puzzle",
+        "etsy_price_eur": costs_df["etsy_price_eur"],
+        "currency": "GBP",
+        "print_price_local": costs_df["monkey_price_gbp"].astype(float),
+        "postage_local": monkey_postage_gbp,
+        "print_cost_eur": (costs_df["monkey_price_gbp"].astype(float) * gbp_to_eur_rate).round(2),
+        "postage_eur": (monkey_postage_gbp * gbp_to_eur_rate).round(2),
+        "base_cost_eur": ((costs_df["monkey_price_gbp"].astype(float) + monkey_postage_gbp) * gbp_to_eur_rate).round(2),
+    })
+    artelo = pd.DataFrame({
+        "size_cm2": costs_df["size_cm2"],
+        "printer": "Artelo",
+        "etsy_price_eur": costs_df["etsy_price_eur"],
+        "currency": "EUR",
+        "print_price_local": costs_df["artelo_price_eur"].astype(float),
+        "postage_local": artelo_postage_eur,
+        "print_cost_eur": costs_df["artelo_price_eur"].astype(float).round(2),
+        "postage_eur": artelo_postage_eur.round(2),
+        "base_cost_eur": (costs_df["artelo_price_eur"].astype(float) + artelo_postage_eur).round(2),
+    })
+    return pd.concat([monkey, artelo], ignore_index=True)
+
+def calc_final_price_vectorized(base_cost_eur, profit_percent, min_profit_eur, etsy_fee_percent, tax_percent):
+    """Vectorized calc_final_price: accepts arrays (broadcast together) and returns NaN where no price is possible."""
+    base_cost_eur = np.asarray(base_cost_eur, dtype=float)
+    desired_profit_amt = np.maximum(base_cost_eur * profit_percent, min_profit_eur)
+    denominator = 1 - (np.asarray(etsy_fee_percent, dtype=float) + tax_percent)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        final_price = np.where(denominator > 0, (base_cost_eur + desired_profit_amt) / denominator, np.nan)
+    tax_eur = final_price * tax_percent
+    etsy_fee_value = final_price * etsy_fee_percent
+    profit_eur = final_price - etsy_fee_value - tax_eur - base_cost_eur
+
+    return np.round(final_price, 2), np.round(profit_eur, 2), np.round(tax_eur, 2)
+
+def audit_current_listings(costs_df, gbp_to_eur_rate, profit_percent, min_profit_eur, etsy_fee_percent, tax_percent):
+    """Compares every current Etsy price with the recommended price for each size x printer in one pass."""
+    audit = compute_costs_table(costs_df, gbp_to_eur_rate)
+    final_price, _, _ = calc_final_price_vectorized(
+        audit["base_cost_eur"], profit_percent, min_profit_eur, etsy_fee_percent, tax_percent
+    )
+
+    # Fees and tax are charged on the price actually listed, not on the recommended one
+    audit["recommended_price_eur"] = final_price
+    audit["total_outgoings_eur"] = (audit["base_cost_eur"] + audit["etsy_price_eur"] * (etsy_fee_percent + tax_percent)).round(2)
+    audit["target_profit_eur"] = np.maximum(audit["base_cost_eur"] * profit_percent, min_profit_eur).round(2)
+    audit["current_profit_eur"] = (audit["etsy_price_eur"] * (1 - etsy_fee_percent - tax_percent) - audit["base_cost_eur"]).round(2)
+    audit["under_margin"] = audit["etsy_price_eur"] < audit["recommended_price_eur"]
+    return audit.sort_values(["size_cm2", "printer"]).reset_index(drop=True)
+
+def diff_cost_matrices(old_costs_df, new_costs_df, gbp_to_eur_rate, profit_percent, min_profit_eur, etsy_fee_percent, tax_percent):
+    """Aligns two parsed cost matrices by size x printer and reports cost, final price and profit changes."""
+    tables = []
+    for costs_df in (old_costs_df, new_costs_df):
+        table = compute_costs_table(costs_df, gbp_to_eur_rate)
+        final_price, profit_eur, _ = calc_final_price_vectorized(
+            table["base_cost_eur"], profit_percent, min_profit_eur, etsy_fee_percent, tax_percent
+        )
+        table["final_price_eur"] = final_price
+        table["profit_eur"] = profit_eur
+        tables.append(table)
+
+    # The listed price stays fixed until we reprice, so both sides use the new workbook's Etsy price
+    old_table = tables[0].drop(columns=["etsy_price_eur", "currency"])
+    diff = old_table.merge(tables[1], on=["size_cm2", "printer"], how="outer", suffixes=("_old", "_new"))
+    diff["currency"] = diff["currency"].fillna(diff["printer"].map({"Monkey Puzzle": "GBP", "Artelo": "EUR"}))
+    net_etsy_price = diff["etsy_price_eur"] * (1 - etsy_fee_percent - tax_percent)
+    diff["etsy_profit_eur_old"] = (net_etsy_price - diff["base_cost_eur_old"]).round(2)
+    diff["etsy_profit_eur_new"] = (net_etsy_price - diff["base_cost_eur_new"]).round(2)
+
+    for column in ["print_price_local", "postage_local"]:
+        diff[f"{column.replace('_local', '')}_delta_local"] = (diff[f"{column}_new"] - diff[f"{column}_old"]).round(2)
+    for column in ["print_cost_eur", "postage_eur", "base_cost_eur", "final_price_eur", "profit_eur", "etsy_profit_eur"]:
+        diff[column.replace("_eur", "_delta_eur")] = (diff[f"{column}_new"] - diff[f"{column}_old"]).round(2)
+
+    # Compare unrounded supplier prices too, so offsetting print/postage changes are not hidden
+    changed = pd.Series(False, index=diff.index)
+    for column in ["print_price_local", "postage_local", "base_cost_eur"]:
+        old, new = diff[f"{column}_old"], diff[f"{column}_new"]
+        changed |= old.ne(new) & ~(old.isna() & new.isna())
+
+    # Sizes (or a printer's offer of a size) present on one side only are added/removed, not unknown deltas
+    offered_old, offered_new = diff["print_price_local_old"].notna(), diff["print_price_local_new"].notna()
+    diff["change"] = np.select(
+        [offered_old & ~offered_new, offered_new & ~offered_old, changed],
+        ["removed", "added", "changed"],
+        default="unchanged",
+    )
+    return diff.sort_values(["size_cm2", "printer"]).reset_index(drop=True)
+
+def simulation_listings(costs_df, gbp_to_eur_rate, use_etsy_price, profit_percent, min_profit_eur, etsy_fee_percent, tax_percent):
+    """Per size x printer supplier-currency costs plus the selling price to stress-test, for simulate_margins."""
+    local = pd.concat([
+        pd.DataFrame({
+            "size_cm2": costs_df["size_cm2"],
+            "printer": "Monkey Puzzle",
+            "print_price": costs_df["monkey_price_gbp"].astype(float),
+            "postage": costs_df["monkey_postage_gbp"].astype(float).fillna(MONKEY_FALLBACK_POSTAGE_GBP),
+            "fallback_postage": MONKEY_FALLBACK_POSTAGE_GBP,
+            "uses_fx": True,
+        }),
+        pd.DataFrame({
+            "size_cm2": costs_df["size_cm2"],
+            "printer": "Artelo",
+            "print_price": costs_df["artelo_price_eur"].astype(float),
+            "postage": costs_df["artelo_postage_eur"].astype(float).fillna(ARTELO_FALLBACK_POSTAGE_EUR),
+            "fallback_postage": ARTELO_FALLBACK_POSTAGE_EUR,
+            "uses_fx": False,
+        }),
+    ], ignore_index=True)
+
+    audit = audit_current_listings(costs_df, gbp_to_eur_rate, profit_percent, min_profit_eur, etsy_fee_percent, tax_percent)
+    listings = audit[["size_cm2", "printer", "etsy_price_eur", "recommended_price_eur"]].merge(local, on=["size_cm2", "printer"])
+    listings["sell_price_eur"] = listings["etsy_price_eur" if use_etsy_price else "recommended_price_eur"]
+    return listings.dropna(subset=["print_price", "sell_price_eur"]).reset_index(drop=True)
+
+def pricing_inputs(key):
+    """Renders the profit/fee/tax inputs and returns them as decimals, or None if the fees exceed 100%."""
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        profit_percent_input = st.number_input("Desired Profit (%)", min_value=0.0, max_value=100.0, value=30.0, step=1.0, key=f"{key}_profit")
+    with col2:
+        min_profit_eur = st.number_input("Minimum profit (€)", min_value=0.0, value=5.0, step=0.5, key=f"{key}_min_profit")
+    with col3:
+        etsy_fee_percent_input = st.number_input("Etsy Fee (%)", min_value=0.0, max_value=100.0, value=15.0, step=1.0, key=f"{key}_etsy_fee")
+    with col4:
+        tax_percent_input = st.number_input("Business Tax (%)", min_value=0.0, max_value=100.0, value=12.3, step=0.1, key=f"{key}_tax")
+
+    if etsy_fee_percent_input + tax_percent_input >= 100:
+        st.error(f"Cannot calculate final prices. The total percentage of fees ({etsy_fee_percent_input:.1f}% Etsy + {tax_percent_input:.1f}% Tax) exceeds 100%.")
+        return None
+    return profit_percent_input / 100, min_profit_eur, etsy_fee_percent_input / 100, tax_percent_input / 100
+
 # -----------------------
 # UI
 # -----------------------
@@ -178,7 +450,7 @@ else:
             st.stop()
     else:
         st.warning(f"No file at {DEFAULT_EXCEL_PATH} and no file uploaded. Using empty dataset.")
-        costs_df = pd.DataFrame(columns=["size_cm2","monkey_price_gbp","monkey_postage_gbp","artelo_price_eur","artelo_postage_eur"])
+        costs_df = pd.DataFrame(columns=["size_cm2","monkey_price_gbp","monkey_postage_gbp","artelo_price_eur","artelo_postage_eur","etsy_price_eur"])
 
 
 # Fetch exchange rate
@@ -187,7 +459,7 @@ current_date = datetime.date.today().strftime("%Y-%m-%d")
 st.sidebar.metric("Live GBP → EUR rate", f"{gbp_to_eur_rate:.4f} (as of {current_date})")
 
 # Tabs for main calculation and database viewing
-tab1, tab2 = st.tabs(["Calculate Price", "View Database"])
+tab1, tab2, tab3, tab4, tab5 = st.tabs(["Calculate Price", "View Database", "Listing Audit", "Price Changes", "Margin Risk"])
 
 with tab1:
     if costs_df.empty:
@@ -323,45 +595,168 @@ with tab1:
                     unsafe_allow_html=True
                 )
 
+                # --- Current Etsy Listing (parsed with the costs, no reload) ---
+                etsy_price_val = row["etsy_price_eur"]
+                if pd.isna(etsy_price_val):
+                    etsy_price_display = "Not Set"
+                    current_profit_display = "N/A"
+                else:
+                    etsy_price_val = float(etsy_price_val)
+                    etsy_price_display = f"€{etsy_price_val:.2f}"
+                    # Fees and tax on the listed price, as in the Listing Audit tab
+                    current_profit_val = etsy_price_val * (1 - etsy_fee_percent - tax_percent) - base_cost_eur
+                    current_profit_display = f"€{current_profit_val:.2f}"
+
+                st.markdown(
+                    f"""
+                    <div style='background-color: #fff9e6; padding: 15px; border-radius: 10px; border-left: 5px solid #ffb300; margin-top: 20px;'>
+                        <h4 style='color: orange; margin-top: 0;'>Current Etsy Listing</h4>
+                        <p style='font-size: 1.1em; color: orange;'>
+                            <b>Etsy Price:</b> {etsy_price_display}<br>
+                            <b>Current Profit:</b> {current_profit_display}
+                        </p>
+                    </div>
+                    """,
+                    unsafe_allow_html=True
+                )
+
 
 with tab2:
     st.subheader("Full Database")
     st.markdown("This table is derived from your uploaded/default Excel file (`print_costs.xlsx`).")
     st.dataframe(costs_df, use_container_width=True)
-  
-  # -----------------------------
-# NEW SECTION: Current Etsy Listing
-# -----------------------------
-# Try to get Etsy price from row 12 (index 11 because zero-based)
-try:
-    etsy_price_val = df.iloc[11, costs_df.columns.get_loc(row.name)]  # fallback if structure known
-except Exception:
-    # Safer method: reload Excel sheet and get row 11 manually
-    try:
-        df_full = pd.read_excel(DEFAULT_EXCEL_PATH, sheet_name=DEFAULT_SHEET, header=None, engine="openpyxl")
-        etsy_price_val = df_full.iloc[11, costs_df.index[costs_df["size_cm2"] == row["size_cm2"]][0]]
-    except Exception:
-        etsy_price_val = None
 
-# If Etsy price missing or NaN
-if pd.isna(etsy_price_val):
-    etsy_price_display = "Not Set"
-    current_profit_display = "N/A"
-else:
-    etsy_price_val = float(etsy_price_val)
-    etsy_price_display = f"€{etsy_price_val:.2f}"
-    current_profit_val = etsy_price_val - total_outgoings_eur
-    current_profit_display = f"€{current_profit_val:.2f}"
-
-st.markdown(
-    f"""
-    <div style='background-color: #fff9e6; padding: 15px; border-radius: 10px; border-left: 5px solid #ffb300; margin-top: 20px;'>
-        <h4 style='color: orange; margin-top: 0;'>Current Etsy Listing</h4>
-        <p style='font-size: 1.1em; color: orange;'>
-            <b>Etsy Price:</b> {etsy_price_display}<br>
-            <b>Current Profit:</b> {current_profit_display}
-        </p>
-    </div>
-    """,
-    unsafe_allow_html=True
-)
+
+with tab3:
+    st.subheader("Current Listing Margin Audit")
+    st.markdown("Compares every current Etsy price from the Excel file with the recommended price for each size and printer.")
+
+    if costs_df.empty:
+        st.error("Cannot run the audit. Please upload a valid print_costs.xlsx file.")
+    else:
+        audit_params = pricing_inputs("audit")
+        if audit_params is not None:
+            audit_df = audit_current_listings(costs_df, gbp_to_eur_rate, *audit_params)
+
+            only_listed = st.checkbox("Only show sizes with a current Etsy price", value=True)
+            if only_listed:
+                audit_df = audit_df[audit_df["etsy_price_eur"].notna()]
+
+            flagged = int(audit_df["under_margin"].sum())
+            if audit_df["etsy_price_eur"].notna().sum() == 0:
+                st.warning("No current Etsy prices were found in the Excel file, so there is nothing to audit.")
+            elif flagged:
+                st.warning(f"{flagged} size/printer combination(s) are priced below the recommended price.")
+            else:
+                st.success("All current listings meet the desired margin.")
+
+            # Under-margin listings first; every column stays sortable in the table
+            audit_df = audit_df.sort_values(["under_margin", "current_profit_eur"], ascending=[False, True])
+            st.dataframe(
+                audit_df.style.apply(
+                    lambda r: ["background-color: #ffebee" if r["under_margin"] else "" for _ in r], axis=1
+                ),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+with tab4:
+    st.subheader("Supplier Price Changes")
+    st.markdown("Upload the previous `print_costs.xlsx` to see how the current costs change every final price and profit.")
+
+    previous_file = st.file_uploader("Upload previous print_costs.xlsx (sheet 'costs')", type=["xlsx"], key="previous_costs")
+
+    if costs_df.empty:
+        st.error("Cannot compare prices. Please upload a valid print_costs.xlsx file.")
+    elif previous_file:
+        try:
+            with BytesIO(previous_file.read()) as b:
+                previous_df = read_matrix_excel(b)
+        except Exception as e:
+            st.error(f"Failed to read previous Excel: {e}")
+            previous_df = pd.DataFrame()
+
+        diff_params = pricing_inputs("diff") if not previous_df.empty else None
+        if diff_params is not None:
+            diff_df = diff_cost_matrices(previous_df, costs_df, gbp_to_eur_rate, *diff_params)
+            changed = diff_df[diff_df["change"] != "unchanged"]
+
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Size/printer combinations changed", len(changed))
+            col2.metric("Average final price change", f"€{changed['final_price_delta_eur'].mean():.2f}" if len(changed) else "€0.00")
+            price_deltas = changed["final_price_delta_eur"].dropna()
+            col3.metric("Largest final price change", f"€{price_deltas.loc[price_deltas.abs().idxmax()]:+.2f}" if len(price_deltas) else "€0.00")
+            col4.metric("Profit change on current Etsy listings", f"€{changed['etsy_profit_delta_eur'].sum():.2f}")
+
+            show_all = st.checkbox("Show unchanged sizes", value=False)
+            st.dataframe(
+                (diff_df if show_all else changed).sort_values("final_price_delta_eur", key=lambda d: d.abs(), ascending=False),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+with tab5:
+    st.subheader("Margin Risk Simulation")
+    st.markdown("Samples GBP → EUR rates and postage scenarios and reports the spread of profit per size and printer at a fixed selling price.")
+
+    if costs_df.empty:
+        st.error("Cannot run the simulation. Please upload a valid print_costs.xlsx file.")
+    else:
+        risk_params = pricing_inputs("risk")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            price_source = st.radio("Selling price to test", ["Recommended price at live rate", "Current Etsy price"], key="risk_price_source")
+            n_scenarios = st.number_input("Scenarios", min_value=1_000, max_value=1_000_000, value=100_000, step=10_000)
+            fx_source = st.radio("GBP → EUR scenarios", ["Normal around live rate", "Rate history (CSV)"], key="risk_fx_source")
+        with col2:
+            fx_sd = st.number_input("GBP → EUR standard deviation", min_value=0.0, max_value=MAX_FX_SD, value=0.03, step=0.005, format="%.3f")
+            postage_sd_input = st.number_input("Postage volatility (% standard deviation)", min_value=0.0, max_value=100.0, value=10.0, step=1.0)
+            fallback_prob_input = st.number_input("Chance postage falls back to default (%)", min_value=0.0, max_value=100.0, value=5.0, step=1.0)
+
+        fx_history = None
+        if fx_source == "Rate history (CSV)":
+            history_file = st.file_uploader("Upload rate history (CSV with a 'rate' column)", type=["csv"], key="fx_history")
+            if history_file:
+                try:
+                    history_df = pd.read_csv(history_file)
+                    fx_history = pd.to_numeric(history_df["rate"], errors="coerce").dropna().to_numpy()
+                except Exception as e:
+                    st.error(f"Failed to read rate history: {e}")
+
+        # Never fall back to the normal distribution silently when history was asked for
+        history_missing = fx_source == "Rate history (CSV)" and (fx_history is None or len(fx_history) == 0)
+        if history_missing:
+            st.error("Upload a rate history CSV with numeric values in a 'rate' column to run the history-based simulation.")
+
+        if risk_params is not None and st.button("Run simulation", disabled=history_missing):
+            _, risk_min_profit_eur, risk_etsy_fee_percent, risk_tax_percent = risk_params
+            listings = simulation_listings(costs_df, gbp_to_eur_rate, price_source == "Current Etsy price", *risk_params)
+            if listings.empty:
+                st.warning("No size has both cost data and a selling price to test.")
+            else:
+                try:
+                    scenarios = sample_scenarios(
+                        int(n_scenarios),
+                        gbp_to_eur_rate,
+                        fx_sd,
+                        postage_sd_input / 100,
+                        fallback_prob_input / 100,
+                        fx_history=fx_history,
+                    )
+                    with st.spinner(f"Simulating {int(n_scenarios):,} scenarios x {len(listings)} listings..."):
+                        risk_df = simulate_margins(
+                            listings,
+                            scenarios,
+                            risk_etsy_fee_percent,
+                            risk_tax_percent,
+                            risk_min_profit_eur,
+                        )
+                except ValueError as e:
+                    st.error(f"Cannot run the simulation: {e}")
+                    st.stop()
+
+                at_risk = int((risk_df["profit_p5_eur"] < risk_min_profit_eur).sum())
+                if at_risk:
+                    st.warning(f"{at_risk} size/printer combination(s) fall below the minimum profit in the worst 5% of scenarios.")
+                st.dataframe(risk_df.sort_values("prob_below_min_profit_pct", ascending=False), use_container_width=True, hide_index=True)
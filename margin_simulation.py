@@ -0,0 +1,143 @@
+"""Monte Carlo margin-risk simulation under FX and postage volatility.
+
+Runs in-process by default. simulate_margins also accepts an executor (e.g. from make_process_pool)
+for use outside the Streamlit app; under Streamlit each worker would re-run app.py on start-up.
+"""
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+PERCENTILES = [5, 25, 50, 75, 95]
+SUPPLIERS = {"Monkey Puzzle": 0, "Artelo": 1}
+DEFAULT_CHUNK_SIZE = 10_000
+# Guards on the histogram size (listings x 1 cent bins), which grows with the sampled cost range
+MAX_FX_SD = 0.1
+FX_HISTORY_RANGE = (0.5, 3.0)
+MAX_PROFIT_BINS = 20_000
+
+def make_process_pool(max_workers=None):
+    """Process pool using forkserver where available, so workers are not forked from a threaded server."""
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    context = multiprocessing.get_context(method)
+    if method == "forkserver":
+        context.set_forkserver_preload(["margin_simulation"])
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+def sample_scenarios(n_scenarios, fx_mean, fx_sd, postage_sd, fallback_prob, fx_history=None, seed=None):
+    """Draws FX rates and per-supplier postage shocks for every scenario."""
+    if fx_history is not None:
+        fx_history = np.asarray(fx_history, dtype=float)
+        if not len(fx_history):
+            raise ValueError("Rate history is empty.")
+        low, high = FX_HISTORY_RANGE
+        bad = fx_history[(fx_history < low) | (fx_history > high)]
+        if len(bad):
+            raise ValueError(f"Rate history has {len(bad)} value(s) outside {low}-{high}, e.g. {bad[0]:g}.")
+    elif not 0 <= fx_sd <= MAX_FX_SD:
+        raise ValueError(f"GBP → EUR standard deviation must be between 0 and {MAX_FX_SD}.")
+
+    rng = np.random.default_rng(seed)
+
+    # Bootstrap from stored rates when given, otherwise a normal around the live rate
+    if fx_history is not None:
+        fx = rng.choice(fx_history, size=n_scenarios)
+    else:
+        fx = rng.normal(fx_mean, fx_sd, n_scenarios)
+
+    return {
+        "fx": np.clip(fx, 0.01, None),
+        # One column per supplier (see SUPPLIERS)
+        "postage_mult": np.clip(rng.normal(1.0, postage_sd, (n_scenarios, len(SUPPLIERS))), 0.0, None),
+        "postage_fallback": rng.random((n_scenarios, len(SUPPLIERS))) < fallback_prob,
+    }
+
+def _profit_cents(fx, postage_mult, postage_fallback, cols, etsy_fee_percent, tax_percent):
+    """Vectorized compute_cost_for_choice + profit at a fixed selling price; scenarios x listings, in cents."""
+    supplier = cols["supplier"]
+    postage = np.where(postage_fallback[:, supplier], cols["fallback_postage"], cols["postage"]) * postage_mult[:, supplier]
+    rate = np.where(cols["uses_fx"], fx[:, None], 1.0)
+    base_cost_eur = np.round((cols["print_price"] + postage) * rate, 2)
+    profit_eur = cols["sell_price_eur"] * (1 - etsy_fee_percent - tax_percent) - base_cost_eur
+    return np.rint(profit_eur * 100).astype(np.int64)
+
+def _simulate_chunk(args):
+    """Process pool worker: histogram of profit (1 cent bins) per listing for one chunk of scenarios."""
+    fx, postage_mult, postage_fallback, cols, etsy_fee_percent, tax_percent, min_profit_eur, lo_cents, n_bins = args
+    profit_cents = _profit_cents(fx, postage_mult, postage_fallback, cols, etsy_fee_percent, tax_percent)
+
+    n_cols = profit_cents.shape[1]
+    bins = np.clip(profit_cents - lo_cents, 0, n_bins - 1) + np.arange(n_cols) * n_bins
+    counts = np.bincount(bins.ravel(), minlength=n_cols * n_bins).reshape(n_cols, n_bins).astype(np.uint32)
+    below_min = (profit_cents < round(min_profit_eur * 100)).sum(axis=0)
+    return counts, below_min
+
+def _bounded_map(pool, fn, items, max_in_flight=None):
+    """Like pool.map, but yields results as they complete and keeps at most max_in_flight tasks queued."""
+    max_in_flight = max_in_flight or 2 * (os.cpu_count() or 1)
+    pending = set()
+    for item in items:
+        pending.add(pool.submit(fn, item))
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in pending:
+        yield future.result()
+
+def simulate_margins(listings, scenarios, etsy_fee_percent, tax_percent, min_profit_eur, chunk_size=DEFAULT_CHUNK_SIZE, pool=None):
+    """Runs every scenario against every listing and reports profit/margin percentiles per size and printer.
+
+    `listings` needs size_cm2, printer, print_price, postage, fallback_postage (supplier currency),
+    uses_fx and sell_price_eur columns. Chunks run in-process unless a `pool` executor is given.
+    """
+    cols = {
+        "supplier": listings["printer"].map(SUPPLIERS).to_numpy(),
+        "print_price": listings["print_price"].to_numpy(dtype=float),
+        "postage": listings["postage"].to_numpy(dtype=float),
+        "fallback_postage": listings["fallback_postage"].to_numpy(dtype=float),
+        "uses_fx": listings["uses_fx"].to_numpy(dtype=bool),
+        "sell_price_eur": listings["sell_price_eur"].to_numpy(dtype=float),
+    }
+    fx, postage_mult, postage_fallback = scenarios["fx"], scenarios["postage_mult"], scenarios["postage_fallback"]
+    n_scenarios = len(fx)
+
+    # Profit falls as FX and postage rise, so the sampled extremes bound every histogram exactly
+    max_postage = np.maximum(cols["postage"], cols["fallback_postage"])
+    min_postage = np.minimum(cols["postage"], cols["fallback_postage"])
+    supplier = cols["supplier"]
+    worst = np.round((cols["print_price"] + max_postage * postage_mult.max(axis=0)[supplier]) * np.where(cols["uses_fx"], fx.max(), 1.0), 2)
+    best = np.round((cols["print_price"] + min_postage * postage_mult.min(axis=0)[supplier]) * np.where(cols["uses_fx"], fx.min(), 1.0), 2)
+    net_price = cols["sell_price_eur"] * (1 - etsy_fee_percent - tax_percent)
+    lo_cents = np.floor((net_price - worst) * 100).astype(np.int64) - 1
+    hi_cents = np.ceil((net_price - best) * 100).astype(np.int64) + 1
+    n_bins = int((hi_cents - lo_cents).max()) + 1
+    if n_bins > MAX_PROFIT_BINS:
+        raise ValueError(f"Scenarios span a profit range of €{n_bins / 100:,.0f}; reduce the FX or postage volatility.")
+
+    chunks = (
+        (fx[i:i + chunk_size], postage_mult[i:i + chunk_size], postage_fallback[i:i + chunk_size],
+         cols, etsy_fee_percent, tax_percent, min_profit_eur, lo_cents, n_bins)
+        for i in range(0, n_scenarios, chunk_size)
+    )
+
+    # Fold each chunk's histogram in as it arrives so only a few are ever held at once
+    counts = np.zeros((len(listings), n_bins), dtype=np.int64)
+    below_min = np.zeros(len(listings), dtype=np.int64)
+    results = map(_simulate_chunk, chunks) if pool is None else _bounded_map(pool, _simulate_chunk, chunks)
+    for chunk_counts, chunk_below in results:
+        counts += chunk_counts
+        below_min += chunk_below
+
+    cumulative = counts.cumsum(axis=1)
+
+    report = listings[["size_cm2", "printer", "sell_price_eur"]].reset_index(drop=True)
+    for p in PERCENTILES:
+        idx = (cumulative >= np.ceil(p / 100 * n_scenarios)).argmax(axis=1)
+        profit_eur = (lo_cents + idx) / 100
+        report[f"profit_p{p}_eur"] = np.round(profit_eur, 2)
+        report[f"margin_p{p}_pct"] = np.round(profit_eur / cols["sell_price_eur"] * 100, 1)
+    report["prob_below_min_profit_pct"] = np.round(below_min / n_scenarios * 100, 1)
+    return report